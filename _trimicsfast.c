@@ -0,0 +1,137 @@
+/*
+ * Optional compiled version of trimics.py's _quickKeep() pre-filter.  Gives
+ * exactly the same answers; trimics.py uses it if it's been built and falls
+ * back to the pure python version if it hasn't.  Build it next to trimics.py:
+ *
+ *   cc -O2 -shared -fPIC $(python3-config --includes) _trimicsfast.c \
+ *       -o _trimicsfast$(python3-config --extension-suffix)
+ */
+
+#define _GNU_SOURCE
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+#include <strings.h>
+
+/*
+ * Read the 8-digit YYYYMMDD stamp at 'p' into 'out'.  False if it runs past
+ * the end of the line or isn't all digits
+ */
+static int stamp(const char *p, const char *lineEnd, long *out)
+{
+    long d = 0;
+
+    if (lineEnd - p < 8)
+        return 0;
+
+    for (int i = 0; i < 8; i++)
+    {
+        unsigned c = (unsigned char)p[i] - '0';
+        if (c > 9)
+            return 0;
+        d = d * 10 + c;
+    }
+
+    *out = d;
+    return 1;
+}
+
+/*
+ * End of the line starting at 'p': its newline, or the last byte if there
+ * isn't one (same as slicing raw[p:raw.find(b'\n', p + 1)] in python)
+ */
+static const char *lineEnd(const char *p, const char *end)
+{
+    const char *e = memchr(p + 1, '\n', end - p - 1);
+    return e ? e : end - 1;
+}
+
+/*
+ * First line starting with 'name' in any case (the newline before it), or
+ * NULL.  Same as the _DTEND_ANYCASE / _RRULE_ANYCASE searches in python
+ */
+static const char *findLineNoCase(const char *raw, const char *end, const char *name, size_t len)
+{
+    const char *p = raw;
+
+    while ((p = memchr(p, '\n', end - p)) != NULL)
+    {
+        if ((size_t)(end - p - 1) >= len && strncasecmp(p + 1, name, len) == 0)
+            return p;
+        p++;
+    }
+
+    return NULL;
+}
+
+static int quickKeep(const char *raw, Py_ssize_t n, long cutoff)
+{
+    const char *end = raw + n;
+    const char *p, *e, *c, *dtend, *rrule;
+    int dated = 0;
+    long d;
+
+    dtend = p = memmem(raw, n, "\nDTEND", 6);
+    if (p)
+    {
+        /* stamp follows the last colon on the line */
+        e = lineEnd(p, end);
+        for (c = e - 1; c >= p && *c != ':'; c--)
+            ;
+
+        /* unreadable (folded, say): let the full check decide */
+        if (c < p || !stamp(c + 1, e, &d) || d >= cutoff)
+            return 1;
+        dated = 1;
+    }
+
+    rrule = p = memmem(raw, n, "\nRRULE:", 7);
+    if (p)
+    {
+        /* no UNTIL= means it never ends */
+        e = lineEnd(p, end);
+        c = e > p ? memmem(p, e - p, "UNTIL=", 6) : NULL;
+        if (!c)
+            return 1;
+
+        if (!stamp(c + 6, e, &d) || d >= cutoff)
+            return 1;
+        dated = 1;
+    }
+
+    /* names are case-insensitive; only drop if the lines looked at are
+       the first DTEND and RRULE lines in any case */
+    if (dated && (findLineNoCase(raw, end, "dtend", 5) != dtend ||
+                  findLineNoCase(raw, end, "rrule", 5) != rrule))
+        return 1;
+
+    return !dated;
+}
+
+static PyObject *py_quickKeep(PyObject *self, PyObject *args)
+{
+    const char *raw;
+    Py_ssize_t n;
+    long cutoff;
+
+    if (!PyArg_ParseTuple(args, "y#l", &raw, &n, &cutoff))
+        return NULL;
+
+    return PyBool_FromLong(quickKeep(raw, n, cutoff));
+}
+
+static PyMethodDef methods[] = {
+    {"quickKeep", py_quickKeep, METH_VARARGS,
+     "quickKeep(raw, cutoff) -> bool\n\n"
+     "Compiled _quickKeep(): should the raw VEVENT bytes be kept for the full check?"},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT, "_trimicsfast", NULL, -1, methods
+};
+
+PyMODINIT_FUNC PyInit__trimicsfast(void)
+{
+    return PyModule_Create(&module);
+}
@@ -21,13 +21,159 @@ options:
 
 """
 
-from icalendar import Calendar, Event
-from dateutil.relativedelta import relativedelta
+from __future__ import annotations
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
+import calendar
+import contextlib
 import datetime
+import functools
+import io
+import mmap
+import re
 import os
 import argparse
 import sys
 
+# icalendar is imported where it's used rather than up here, so things like
+# '--help' or a bad argument don't pay for loading it
+if TYPE_CHECKING:
+    from icalendar import Calendar, Event
+
+"""
+icalendar's Calendar and Event classes, each imported the first time it's
+asked for.  After that it's just a cached lookup, so even the per-event paths
+don't run an import statement every call
+"""
+@functools.cache
+def _calendarClass() -> type[Calendar]:
+    from icalendar import Calendar
+
+    return (Calendar)
+
+@functools.cache
+def _eventClass() -> type[Event]:
+    from icalendar import Event
+
+    return (Event)
+
+# big write buffer so streaming events out one at a time doesn't mean a
+# syscall per event; most output files go out in a single write
+_WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+# BEGIN/END lines of a VEVENT or VTIMEZONE, for slicing them out of the raw
+# file.  Names are case-insensitive per RFC 5545
+_DELIMITERS = re.compile(rb'^(BEGIN|END):(VEVENT|VTIMEZONE)\r?$', re.MULTILINE | re.IGNORECASE)
+
+# first DTEND / RRULE line in any case, for _quickKeep() to check that it
+# looked at the right ones
+_DTEND_ANYCASE = re.compile(rb'\ndtend', re.IGNORECASE)
+_RRULE_ANYCASE = re.compile(rb'\nrrule', re.IGNORECASE)
+
+"""
+Pull the 8-digit YYYYMMDD stamp at 'inx' in 'line' out as an int, or None if
+it isn't one
+"""
+def _stamp(line : bytes, inx : int) -> int | None:
+    s = line[inx:inx + 8]
+    if len(s) == 8 and s.isdigit():
+        return (int(s))
+
+    return (None)
+
+"""
+Cheap test on the raw bytes of a VEVENT to decide whether it's even worth
+parsing.  Only says no when the event clearly ends before the cutoff: the
+DTEND stamp and any RRULE UNTIL stamp are both before it.  A never-ending
+RRULE, or anything it can't make sense of, is kept and left to the full check.
+Just a few bytes.find() calls, no parsing.  Property names are case-insensitive,
+so before dropping an event, two case-insensitive regex searches make sure its
+first DTEND and RRULE lines are the upper-case ones that were looked at
+"""
+def _quickKeep(raw : bytes, cutoff : int) -> bool:
+    dated = False
+
+    dtend = p = raw.find(b'\nDTEND')
+    if p >= 0:
+        line = raw[p:raw.find(b'\n', p + 1)]
+        # unreadable (folded, say): let the full check decide
+        d = _stamp(line, line.rfind(b':') + 1)
+        if d is None or d >= cutoff:
+            return (True)
+        dated = True
+
+    rrule = p = raw.find(b'\nRRULE:')
+    if p >= 0:
+        line = raw[p:raw.find(b'\n', p + 1)]
+        u = line.find(b'UNTIL=')
+        if u < 0:
+            return (True)
+
+        d = _stamp(line, u + 6)
+        if d is None or d >= cutoff:
+            return (True)
+        dated = True
+
+    if dated:
+        m = _DTEND_ANYCASE.search(raw)
+        if (m.start() if m else -1) != dtend:
+            return (True)
+
+        m = _RRULE_ANYCASE.search(raw)
+        if (m.start() if m else -1) != rrule:
+            return (True)
+
+    return (not dated)
+
+# use the compiled version of _quickKeep() if it's been built (see
+# _trimicsfast.c); it gives the same answers, just faster
+try:
+    from _trimicsfast import quickKeep as _quickKeep
+except ImportError:
+    pass
+
+"""
+List-like wrapper around the raw bytes of each VEVENT read from a file.  An
+Event is only built (and then remembered) the first time it's asked for, so
+reading a big calendar doesn't mean parsing every event in it.
+"""
+class _lazyEvents(object):
+    def __init__(self, raw : list[bytes]):
+        self._fromIcal = _eventClass().from_ical
+        self._raw = raw
+        self._parsed = [None] * len(raw)
+
+    def __len__(self) -> int:
+        return (len(self._raw))
+
+    def __getitem__(self, inx : int) -> Event:
+        event = self._parsed[inx]
+        if event is None:
+            event = self._fromIcal(self._raw[inx])
+            self._parsed[inx] = event
+
+        return (event)
+
+    # like [inx], but a freshly parsed event isn't kept around.  For one-shot
+    # passes over the whole calendar
+    def peek(self, inx : int) -> Event:
+        event = self._parsed[inx]
+        if event is None:
+            event = self._fromIcal(self._raw[inx])
+
+        return (event)
+
+    def __iter__(self):
+        for inx in range(len(self._raw)):
+            yield self[inx]
+
+    def getRaw(self, inx : int) -> bytes | None:
+        return (self._raw[inx])
+
+    def append(self, e : Event):
+        self._raw.append(None)
+        self._parsed.append(e)
+
 """
 Class to do a few specific things to an iCal-formatted calendar file:
 + load an iCal from file
@@ -42,9 +188,19 @@ class ical(object):
     def __init__(self, fname : str, verbosity : bool):
         self._fname = fname
         self._verbosity = verbosity
-        self._file = None
-        self._calendar = Calendar()
-        self._events = []
+
+        # the Calendar only holds the header (PRODID, VERSION...).  Events
+        # live in self._events alone, VTIMEZONEs in self._timezones
+        self._calendar = _calendarClass()()
+        self._events = _lazyEvents([])
+
+        # raw bytes of each VTIMEZONE read from a file.  Never parsed, just
+        # copied through as-is when writing
+        self._timezones = []
+
+        # upper-cased SUMMARY of each event, filled in the first time
+        # findEventBySummary looks at it.  Parallel to self._events
+        self._summariesUpper = []
 
     """
     Clear all data from the calendar
@@ -53,34 +209,59 @@ class ical(object):
         if not self._calendar.is_empty():
             self._calendar.clear()
 
+        self._events = _lazyEvents([])
+        self._timezones = []
+        self._summariesUpper = []
+
     """
     Create a new calendar, iCal version 2
     """
     def createNew(self):
         self.reset()
-        self._calendar = Calendar()
+        self._calendar = _calendarClass()()
         self._calendar.add('prodid', 'Matty cleaned calendar')
         self._calendar.add('version', '2.0')
 
     """
-    Write this calendar out to an .ical file
+    Write this calendar out to an .ical file.  The calendar is streamed out a
+    component at a time rather than serialized into one big blob first.  Pass
+    'events' to write those instead of the calendar's own; they're consumed
+    one at a time, so a generator never has to be held in memory all at once.
+
+    Only file errors are caught here; anything raised while producing
+    'events' is passed on to the caller
     """
-    def writeToFile(self) -> bool:
-        if not self._calendar.is_empty():
-            try:
-                outfile = open(self._fname, 'wb')
-                outfile.write(self._calendar.to_ical())
-                outfile.close()
+    def writeToFile(self, events : Iterable[Event] | None = None) -> bool:
+        if self._calendar.is_empty():
+            return (False)
 
-                print ('Wrote {} events to \'{}\''
-                    .format(self.getEventCount(), self._fname))
+        # calendar properties only (PRODID, VERSION...), split into the
+        # BEGIN...properties prologue and the END:VCALENDAR epilogue
+        header = _calendarClass()()
+        header.update(self._calendar)
+        prologue, _, epilogue = header.to_ical().rpartition(b'END:')
+
+        try:
+            with io.BufferedWriter(io.FileIO(self._fname, 'wb'), buffer_size=_WRITE_BUFFER_SIZE) as outfile:
+                outfile.write(prologue)
+                for timezone in self._timezones:
+                    outfile.write(timezone)
+                for component in self._calendar.subcomponents:
+                    outfile.write(component.to_ical())
+                count = 0
+                for event in (self._events if events is None else events):
+                    outfile.write(event.to_ical())
+                    count += 1
+                outfile.write(b'END:' + epilogue)
+
+        except OSError as ex:
+            print (ex)
+            return (False)
 
-                return (True)
-        
-            except Exception as ex:
-                print (ex)
-        
-        return (False)
+        print ('Wrote {} events to \'{}\''
+            .format(count, self._fname))
+
+        return (True)
 
     """
     Read an .ical file and populate this calendar object.  Will also
@@ -92,7 +273,7 @@ class ical(object):
                 if self._verbosity:
                     print ('\'{}\' size is {} bytes'.format(self._fname, os.stat(self._fname).st_size))
                 
-                self._file = open(self._fname, 'rb')
+                infile = open(self._fname, 'rb')
             except FileNotFoundError:
                 print ('Input file \'{}\' not found!'.format(self._fname))
                 return (False)
@@ -103,10 +284,50 @@ class ical(object):
             if self._verbosity:
                 print ('Reading calendar entries from \'{}\''.format(self._fname))
             
-            self._calendar = Calendar.from_ical(self._file.read())
-            self._file.close()
-
-            self._events = self._calendar.walk('VEVENT')
+            # single pass over the memory-mapped file.  Each VEVENT is sliced
+            # out as raw bytes to be parsed later, on demand.  Each VTIMEZONE
+            # is sliced out too and never parsed at all (they can be huge and
+            # we don't change them).  Everything else (VERSION, PRODID...) is
+            # the calendar header and gets parsed right away.  Folded lines
+            # start with a space or tab, so a continuation can never look like
+            # a BEGIN/END line.  Pipes, FIFOs and empty files can't be mapped,
+            # so those are just read in; slicing works the same on bytes
+            header = []
+            events = []
+            timezones = []
+            with infile:
+                try:
+                    source = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    source = contextlib.nullcontext(infile.read())
+
+                with source as mm:
+                    # one regex scan for every delimiter in the file; 'start' is
+                    # where the component we're inside of began and 'kind' what it
+                    # is, None between components
+                    pos = 0
+                    start = None
+                    kind = None
+                    for m in _DELIMITERS.finditer(mm):
+                        delim = m.group(1).upper()
+                        if start is None:
+                            if delim == b'BEGIN':
+                                start = m.start()
+                                kind = m.group(2).upper()
+                        elif delim == b'END' and m.group(2).upper() == kind:
+                            # include the END line ending
+                            end = min(m.end() + 1, len(mm))
+                            header.append(mm[pos:start])
+                            (events if kind == b'VEVENT' else timezones).append(mm[start:end])
+                            pos = end
+                            start = None
+
+                    header.append(mm[pos:])
+
+            self._calendar = _calendarClass().from_ical(b''.join(header))
+            self._events = _lazyEvents(events)
+            self._timezones = timezones
+            self._summariesUpper = [None] * len(events)
 
             print ('Read {} events from \'{}\''
                     .format(self.getEventCount(), self._fname))
@@ -116,6 +337,13 @@ class ical(object):
             print ('Error - clear calendar before loading new data')
             return (False)
     
+    """
+    Copy the VTIMEZONEs of another calendar into this one, so events copied
+    over from it still have their timezone definitions when written out
+    """
+    def copyTimezones(self, other : ical):
+        self._timezones.extend(other._timezones)
+
     """
     How many events in this calendar?
     """
@@ -127,14 +355,13 @@ class ical(object):
     order in which they exist in the calendar.  There's no sorting
     """
     def getEvent(self, eventID : int) -> Event | None:
-        if not self._calendar.is_empty():
-            try:
-                return (self._events[eventID])
-            except IndexError:
-                if self._verbosity:
-                    print ('Tried to get Event {} (calendar has {} events)'
-                        .format(eventID, self.getEventCount()))
-        
+        if 0 <= eventID < len(self._events):
+            return (self._events[eventID])
+
+        if self._verbosity:
+            print ('Tried to get Event {} (calendar has {} events)'
+                .format(eventID, self.getEventCount()))
+
         return (None)
     
     """
@@ -144,13 +371,13 @@ class ical(object):
         if self._calendar.is_empty():
             self.createNew()
 
-        self._calendar.add_component(e)
         self._events.append(e)
+        self._summariesUpper.append(None)
 
         return (True)
 
     """
-    Return a list of Events.  The events to be returned either:
+    Generate the Events that either:
     + have an end date later than today minus 'months' months
     + are recurring with no end date
     + are recurring, but have an end date later than today minus
@@ -159,56 +386,85 @@ class ical(object):
     This is a bit hokey because the DTEND and RRULE subcomponents
     of an .ical might be dates, might be date/times, might be timezone
     aware or naive.  Sigh.
-    """
-    def findEventsByDateAfter(self, months : int) -> list[Event]:
-        retList = []
 
-        # cutoff date is today minus some number of months
-        cutoff = datetime.datetime.now().date() - relativedelta(months=months)
+    Events come out one at a time and aren't kept, so this can feed
+    writeToFile() directly without the whole result ever being in memory.
+    """
+    def findEventsByDateAfter(self, months : int) -> Iterator[Event]:
+        # cutoff date is today minus some number of months.  If that lands
+        # past the end of a short month, use the last day of that month
+        today = datetime.date.today()
+        year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+        month += 1
+        day = min(today.day, calendar.monthrange(year, month)[1])
+        cutoff = today.replace(year=year, month=month, day=day)
 
         if self._verbosity:
             print ('Finding all events that end after {}'.format(cutoff))
 
+        # compare days as plain ints rather than date objects.  Read-in events
+        # still carry their raw bytes; skip the ones that obviously end too
+        # early without ever parsing them
+        cutoffOrd = cutoff.toordinal()
+        cutoffStamp = cutoff.year * 10000 + cutoff.month * 100 + cutoff.day
+
         # iterate over all the Event objects in the list
-        for event in self._events:
+        for inx in range(len(self._events)):
+            raw = self._events.getRaw(inx)
+            if raw is not None and not _quickKeep(raw, cutoffStamp):
+                continue
 
-            # assume no recurrence
+            event = self._events.peek(inx)
+
+            # assume no recurrence.  Look each subcomponent up once; most
+            # events have no RRULE
             recurring = False
 
-            try:
-                x = event['RRULE']
-                # if there is an 'RRULE' subcomponent, then it is recurring
-                
+            # if there is an 'RRULE' subcomponent, then it is recurring
+            rrule = event.get('RRULE')
+            if rrule is not None:
+                until = rrule.get('UNTIL')
+
                 # if there's no end date, add it
-                if 'UNTIL' not in x:
+                if not until:
                     recurring = True
                 else:
-                    d = event['RRULE']['UNTIL'][0]
+                    d = until[0]
                     if isinstance(d, datetime.datetime):
                         d = d.date()
 
                     # if the end date is after our cutoff, add it
-                    if d >= cutoff:
+                    if d.toordinal() >= cutoffOrd:
                         recurring = True
 
-            except KeyError:
-                pass
-
-            # if DTEND subcomponent is a date/time, convert it to just a date
-            if isinstance(event['DTEND'].dt, datetime.datetime):
-                end = event['DTEND'].dt.date()
+            # no DTEND is fine by RFC 5545: the end is DTSTART plus DURATION,
+            # or DTSTART alone (a whole day for a date).  With no DTSTART
+            # either there's no telling, so the event is kept
+            end = None
+            dtend = event.get('DTEND')
+            if dtend is not None:
+                end = dtend.dt
             else:
-                end = event['DTEND'].dt
+                dtstart = event.get('DTSTART')
+                if dtstart is not None:
+                    end = dtstart.dt
+                    duration = event.get('DURATION')
+                    if duration is not None:
+                        end = end + duration.dt
+                    elif not isinstance(end, datetime.datetime):
+                        end = end + datetime.timedelta(days=1)
+
+            # if the end is a date/time, convert it to just a date
+            if isinstance(end, datetime.datetime):
+                end = end.date()
 
             # if end is after our cutoff (or a qualifying recurrence), add it
             # to the output list
-            if end >= cutoff or recurring:
+            if recurring or end is None or end.toordinal() >= cutoffOrd:
                 if self._verbosity:
                     print ('Adding event {}'.format(event['SUMMARY']))
 
-                retList.append(event)
-
-        return (retList)
+                yield event
 
     """
     String matching to find an event based on summary text.  Return type is a tuple of
@@ -216,23 +472,18 @@ class ical(object):
     to implement a 'find next' 
     """
     def findEventBySummary(self, srch : str, startInx = 0) -> tuple[int, Event | None] :
-        ret = (startInx, None)
+        srchUpper = srch.upper()
 
-        if not self._calendar.is_empty():
-            found = False
-            while not found:
-                thisEvent = self.getEvent(startInx)
+        for inx in range(startInx, len(self._events)):
+            summary = self._summariesUpper[inx]
+            if summary is None:
+                summary = str(self._events[inx]['SUMMARY']).upper()
+                self._summariesUpper[inx] = summary
 
-                if srch.upper() in thisEvent['SUMMARY'].upper():
-                    ret = (startInx, thisEvent)
-                    break
-                
-                startInx += 1
-
-                if startInx >= self.getEventCount():
-                    break
+            if summary.find(srchUpper) != -1:
+                return (inx, self._events[inx])
 
-        return (ret)
+        return (startInx, None)
 
     """
     Strip all non-standard subcomponents from the passed event.  For example,
@@ -243,10 +494,10 @@ class ical(object):
     """
     @staticmethod
     def stripApplicationSpecificSubcomponents(event : Event) -> Event | None:
-        retEvent = Event()
-        for subComponent in event:
-            if 'X-' not in subComponent:
-                retEvent[subComponent] = event[subComponent]
+        retEvent = _eventClass()()
+        for subComponent, value in event.items():
+            if not subComponent.startswith('X-'):
+                retEvent[subComponent] = value
 
         return (retEvent)
 
@@ -269,14 +520,15 @@ if __name__ == '__main__':
     # create a new empty calendar
     outcal = ical(args.outfile, args.verbose)
     outcal.createNew()
+    outcal.copyTimezones(incal)
 
-    # go through the input calendar.  For every Event that ends after 
-    # today minus specified monts, add it to the output calendar.
+    # go through the input calendar.  Every Event that ends after today
+    # minus specified months goes straight out to the output file.
     # Optionally, strip application specific crap to reduce output file size.
-    for event in incal.findEventsByDateAfter(args.monthsBefore):
-        if args.stripAppSpecific:
-            outcal.addEvent(ical.stripApplicationSpecificSubcomponents(event))
-        else:
-            outcal.addEvent(event)
+    events = incal.findEventsByDateAfter(args.monthsBefore)
+    if args.stripAppSpecific:
+        events = map(ical.stripApplicationSpecificSubcomponents, events)
 
-    outcal.writeToFile()
+    if not outcal.writeToFile(events):
+        print ('error writing output file')
+        sys.exit(1)